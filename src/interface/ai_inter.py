@@ -1,24 +1,175 @@
+import ast
+import asyncio
+import copy
+import functools
+import hashlib
 import inspect
-import json
-from typing import Callable, Optional
+import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from collections.abc import Hashable
+from types import FunctionType
+from typing import Callable, NamedTuple, Optional
 
-from openai import OpenAI, OpenAIError
+import httpx
+import numpy as np
+import orjson
+from openai import AsyncOpenAI, OpenAI, OpenAIError
+import pandas as pd
 from pandas import DataFrame
 
-from src.interface.exceptions import InterfaceException, InterfaceOpenAIException, \
-    UnknownModelException
-from src.interface.prompts import PROMPT_TEMPLATE
+from src.interface.exceptions import CommandApplyError, InterfaceException, \
+    InterfaceOpenAIException, UnknownModelException
+from src.interface.prompts import PROMPT_TEMPLATE, PROMPT_TEMPLATE_ERROR, PROMPT_TEMPLATE_TASKS, \
+    split_template
 from src.logger import logger
 from private import env
 
+
+class Command(NamedTuple):
+    """Validated command ready to be applied"""
+    name: str
+    kwargs: dict
+
+
+# rendered command descriptions keyed by the function itself, shared between instances.
+# decorated commands and closures share one code object, so it can not be the key
+_DESC_CACHE: weakref.WeakKeyDictionary[Callable, tuple[str, inspect.Signature]] = \
+    weakref.WeakKeyDictionary()
+
+_JSON_BLOCK_RE = re.compile(rb"\{.*\}", re.DOTALL)
+_OPEN_BRACE, _CLOSE_BRACE, _QUOTE, _BACKSLASH = b'{}"\\'
+
+# predicates come from the model and are checked with _check_predicate before compiling,
+# the restricted builtins only limit what names a valid lambda can resolve
+_PREDICATE_BUILTINS: dict[str, object] = {
+    "abs"       : abs,
+    "bool"      : bool,
+    "float"     : float,
+    "int"       : int,
+    "isinstance": isinstance,
+    "len"       : len,
+    "max"       : max,
+    "min"       : min,
+    "round"     : round,
+    "str"       : str,
+}
+_SAFE_GLOBALS: dict[str, object] = {"__builtins__": _PREDICATE_BUILTINS}
+
+# methods a predicate may call on its value, e.g. x.startswith('a') or x.str.contains('a')
+_PREDICATE_METHODS: frozenset[str] = frozenset({
+    "startswith", "endswith", "lower", "upper", "strip", "isdigit", "isalpha", "isalnum",
+    "contains", "isin", "between", "isna", "notna",
+})
+
+_PREDICATE_NODES: tuple[type, ...] = (
+    ast.Expression, ast.Lambda, ast.arguments, ast.arg, ast.Compare, ast.BoolOp, ast.BinOp,
+    ast.UnaryOp, ast.IfExp, ast.Name, ast.Constant, ast.Call, ast.keyword, ast.Attribute,
+    ast.Subscript, ast.Slice, ast.Tuple, ast.List, ast.Set, ast.Load, ast.cmpop, ast.boolop,
+    ast.operator, ast.unaryop,
+)
+
+# comparison strings applied to the whole column with DataFrame.query, e.g. "> 50"
+_COMPARISON_RE = re.compile(r"\s*(?:[<>]=?|[=!]=|(?:not\s+)?in\b)")
+_COMPARISON_NODES: tuple[type, ...] = (
+    ast.Expression, ast.Compare, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Name, ast.Constant,
+    ast.Tuple, ast.List, ast.Load, ast.cmpop, ast.boolop, ast.operator, ast.unaryop,
+)
+
+
+def _check_comparison(source: str) -> Optional[str]:
+    """
+    Returns why the comparison string is rejected or None if it only compares the column
+    with constants or other columns. Local variables (@name) are never reachable.
+    """
+    if "@" in source:
+        return "local variables are not allowed"
+    try:
+        tree = ast.parse(f"column {source.strip()}", "<predicate>", "eval")
+    except SyntaxError as e:
+        return f"comparison is not valid: {e.msg}"
+    for node in ast.walk(tree):
+        if not isinstance(node, _COMPARISON_NODES):
+            return f"{type(node).__name__} is not allowed"
+    return None
+
+
+def _check_predicate(tree: ast.Expression) -> Optional[str]:
+    """
+    Returns why the parsed predicate is rejected or None if it is a plain lambda built from
+    comparisons, arithmetic, lookups and whitelisted calls, without any private attributes.
+    """
+    root = tree.body
+    if not isinstance(root, ast.Lambda):
+        return "predicate must be a lambda or a comparison like '> 50'"
+    names = {arg.arg for arg in ast.walk(root.args) if isinstance(arg, ast.arg)}
+    names.update(_PREDICATE_BUILTINS)
+    for node in ast.walk(root):
+        nested_lambda = isinstance(node, ast.Lambda) and node is not root
+        if nested_lambda or not isinstance(node, _PREDICATE_NODES):
+            return f"{type(node).__name__} is not allowed"
+        if isinstance(node, ast.Name) and node.id not in names:
+            return f"name {node.id} is not defined"
+        if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+            return f"attribute {node.attr} is not allowed"
+        if isinstance(node, ast.Call):
+            func = node.func
+            if not (isinstance(func, ast.Name) and func.id in _PREDICATE_BUILTINS
+                    or isinstance(func, ast.Attribute) and func.attr in _PREDICATE_METHODS):
+                return f"call of {ast.unparse(func)} is not allowed"
+    return None
+
+
+@functools.lru_cache(maxsize=32)
+def _system_envelope(system: str) -> dict[str, str]:
+    """Returns the system message, shared between requests so it must not be mutated"""
+    return {"role": "system", "content": system}
+
+
+@functools.lru_cache(maxsize=64)
+def _get_error_prompt(template: str, error_message: str) -> str:
+    """Creating a formatted retry prompt, the same errors repeat across retries"""
+    prefix, suffix = split_template(template, "error_msg")
+    return prefix + error_message + suffix
+
+
+# commands that only pick, drop or relabel columns can be planned on labels alone.
+# they are marked with a column_operation attribute or by add_command and take
+# a list of columns (select, drop) or a mapping of old to new labels (rename)
+_COLUMN_OPERATIONS: frozenset[str] = frozenset({"select", "drop", "rename"})
+
+# backups and per request frames are shallow copies, copy-on-write keeps them isolated.
+# pandas >= 3 always uses copy-on-write and deprecates the option
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
 class AIInterface:
     """
     An interface that manages commands, constructs prompts, and communicates
     with OpenAI's API to generate and apply commands on a DataFrame.
     """
     _PROMPT_TEMPLATE: str = PROMPT_TEMPLATE
+    _PROMPT_TEMPLATE_ERROR: str = PROMPT_TEMPLATE_ERROR
+    _PROMPT_TEMPLATE_TASKS: str = PROMPT_TEMPLATE_TASKS
+
+    _tested_models: frozenset[str] = frozenset({"gpt-4", "gpt-4o", "gpt-4-turbo"})
+
+    _response_cache_size: int = 128
 
-    _tested_models: list[str] = ["gbt-4"]
+    _backup_size: int = 8
+
+    _http_limits: httpx.Limits = httpx.Limits(
+            max_keepalive_connections=20,
+            max_connections=100,
+            keepalive_expiry=30.0,
+    )
+    _http_timeout: httpx.Timeout = httpx.Timeout(60.0, connect=10.0)
+
+    _embedding_model: str = "text-embedding-3-small"
+    _semantic_threshold: float = 0.95
 
     default_settings = {
         "model"            : "gpt-4",
@@ -36,9 +187,18 @@ class AIInterface:
             top_p: Optional[float] = 0.9,
             frequancy_penalty: Optional[float] = 0.0,
             presence_penalty: Optional[float] = 0.0,
+            enable_cache: bool = False,
+            semantic_cache: bool = False,
+            use_batch_api: bool = False,
+            prewarm: bool = False,
     ) -> None:
-        logger.debug(f"Initializing {self.__class__.__name__}")
-        self._client = OpenAI()
+        logger.debug("Initializing %s", self.__class__.__name__)
+        # one pooled transport for every request so retries reuse the TLS session,
+        # clients are created on first use so code that only applies commands never opens them
+        self._http: Optional[httpx.Client] = None
+        self._client_impl: Optional[OpenAI] = None
+        self._ahttp: Optional[httpx.AsyncClient] = None
+        self._aclient_impl: Optional[AsyncOpenAI] = None
         self.llm_settings(
                 model_name=model,
                 temperature=temperature,
@@ -49,43 +209,150 @@ class AIInterface:
 
         self.commands_description: dict[str, str] = {}
         self.commands: dict[str, Callable] = {}
+        self._commands_get = self.commands.get
+        # used by the local validator to fix commands without asking the model again
+        self._commands_signature: dict[str, inspect.Signature] = {}
+        self._commands_lower: dict[str, str] = {}
+        # command name -> column operation of the commands that can be fused
+        self._column_commands: dict[str, str] = {}
 
         # primitive cashing
 
-        self._commands_updated = False
-        self._available_commands = None
-        self._backup: list[DataFrame] = []
+        # bumped on every change of commands,
+        # derived strings remember the version they were built on
+        self._version = 0
+        self._available_version = 0
+        self._desc_lines: dict[str, str] = {}
+        self._available_commands: str = ""
+        self._cached_prompt: Optional[str] = None
+        self._cached_prompt_key: Optional[tuple[int, int]] = None
+        # only the most recent frames are kept, reset_frame falls back to the oldest of them
+        self._backup: deque[DataFrame] = deque(maxlen=self._backup_size)
+
+        # parsed responses keyed by request hash, only used for reproducible requests
+        self._enable_cache = enable_cache
+        self._predicate_cache: dict[str, Callable] = {}
+        self._response_cache: OrderedDict[str, dict] = OrderedDict()
+
+        # normalized request embeddings (one row each) and the commands they resolved to
+        self._semantic_cache = semantic_cache
+        self._semantic_vectors: Optional[np.ndarray] = None
+        self._semantic_commands: list[dict] = []
+
+        self._use_batch_api = use_batch_api
 
         if load_modules:
             self.add_modules_commands(load_modules)
 
-    def add_command(self, command: Callable) -> None:
-        """Adds new command to a class"""
+        if prewarm:
+            # the client is built here, the thread only uses it
+            threading.Thread(target=self._prewarm, args=(self._client,), daemon=True).start()
+
+    @property
+    def _client(self) -> OpenAI:
+        """OpenAI client on the pooled transport, created on first use"""
+        if self._client_impl is None:
+            self._http = httpx.Client(limits=self._http_limits, timeout=self._http_timeout)
+            self._client_impl = OpenAI(http_client=self._http)
+        return self._client_impl
+
+    @property
+    def _aclient(self) -> AsyncOpenAI:
+        """AsyncOpenAI client on its own pooled transport, created on first use"""
+        if self._aclient_impl is None:
+            self._ahttp = httpx.AsyncClient(limits=self._http_limits, timeout=self._http_timeout)
+            self._aclient_impl = AsyncOpenAI(http_client=self._ahttp)
+        return self._aclient_impl
+
+    @staticmethod
+    def _prewarm(client: OpenAI) -> None:
+        """Opens a pooled connection ahead of the first request"""
+        try:
+            client.models.list()
+            logger.debug("Connection pool is warm")
+        except OpenAIError as e:
+            logger.debug("Connection prewarm failed: %s", e)
+
+    def close(self) -> None:
+        """Closes the pooled http connections"""
+        if self._http is not None:
+            logger.debug("Closing http client")
+            self._http.close()
+
+    async def aclose(self) -> None:
+        """Closes both the pooled sync and async http connections"""
+        self.close()
+        if self._ahttp is not None:
+            await self._ahttp.aclose()
+
+    def __enter__(self) -> "AIInterface":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def add_command(self, command: Callable, column_operation: Optional[str] = None) -> None:
+        """
+        Adds new command to a class. column_operation ("select", "drop" or "rename") marks
+        a command that only changes columns, consecutive ones are applied as one selection.
+        """
+        self._register_command(command, column_operation)
+        self._commands_changed()
+
+    def _register_command(self, command: Callable, column_operation: Optional[str] = None) -> None:
+        """Stores the command and its pre-rendered description line"""
         name = command.__name__
-        logger.info(f"Adding command: %s", name)
-        signature = inspect.signature(command)
-        docstring = inspect.getdoc(command)
+        logger.debug("Adding command: %s", name)
+        operation = column_operation or getattr(command, "column_operation", None)
+        if operation is not None and operation not in _COLUMN_OPERATIONS:
+            raise InterfaceException(f"Unknown column operation {operation} of command {name}.")
+        try:
+            cached = _DESC_CACHE.get(command)
+        except TypeError:
+            # callables without weak reference support are described on every registration
+            cached = None
+        if cached is None:
+            signature = inspect.signature(command)
+            docstring = (inspect.getdoc(command) or "No description").replace("\n", " ")
+            cached = (f"{signature} - {docstring}", signature)
+            try:
+                _DESC_CACHE[command] = cached
+            except TypeError:
+                pass
+        description, signature = cached
 
-        description = f"{signature} - {docstring.replace("\n", "") or "No description"}"
-        self._commands_updated = True
         self.commands_description[name] = description
+        self._desc_lines[name] = f"{name}{description}"
         self.commands[name] = command
+        self._commands_signature[name] = signature
+        self._commands_lower[name.lower()] = name
+        if operation is None:
+            self._column_commands.pop(name, None)
+        else:
+            self._column_commands[name] = operation
+
+    def _commands_changed(self) -> None:
+        """Invalidates everything derived from the set of commands"""
+        self._version += 1
+        self._semantic_vectors = None
+        self._semantic_commands = []
 
     def add_modules_commands(self, modules: list[object]) -> None:
         """parses functions inside a modules in the list and adds them to the class"""
         for module in modules:
-            logger.info(f"Adding module: %s", module.__name__)
-            for _, func in inspect.getmembers(module, inspect.isfunction):
-                self.add_command(func)
+            logger.info("Adding module: %s", module.__name__)
+            for func in module.__dict__.values():
+                # skip functions imported into the module from elsewhere
+                if isinstance(func, FunctionType) and func.__module__ == module.__name__:
+                    self._register_command(func)
+        self._commands_changed()
 
     def _get_available_commands(self) -> str:
         """Returns the list of available commands"""
-        if self._commands_updated:
-            self._available_commands = [
-                f"{name}{description}" for name, description in self.commands_description.items()
-            ]
-        if self._available_commands:
-            return "\n".join(self._available_commands)
+        if self._available_version != self._version:
+            self._available_commands = "\n".join(self._desc_lines.values())
+            self._available_version = self._version
+        return self._available_commands
 
     def llm_settings(
             self, *,
@@ -99,24 +366,38 @@ class AIInterface:
         if model_name:
             if model_name not in self._tested_models:
                 raise UnknownModelException(f"Unknown model name {model_name}")
-            logger.debug(f"Using model name: {model_name}")
+            logger.debug("Using model name: %s", model_name)
             self.default_settings["model"] = model_name
-        if temperature:
-            logger.debug(f"Using temperature: {temperature}")
+        if temperature is not None:
+            logger.debug("Using temperature: %s", temperature)
             self.default_settings["temperature"] = temperature
-        if top_p:
-            logger.debug(f"Using top p: {top_p}")
+        if top_p is not None:
+            logger.debug("Using top p: %s", top_p)
             self.default_settings["top_p"] = top_p
-        if frequancy_penalty:
-            logger.debug(f"Using frequancy penalty: {frequancy_penalty}")
+        if frequancy_penalty is not None:
+            logger.debug("Using frequancy penalty: %s", frequancy_penalty)
             self.default_settings["frequancy_penalty"] = frequancy_penalty
-        if presence_penalty:
-            logger.debug(f"Using presence penalty: {presence_penalty}")
+        if presence_penalty is not None:
+            logger.debug("Using presence penalty: %s", presence_penalty)
             self.default_settings["presence_penalty"] = presence_penalty
 
+        # snapshot of the settings in _send_request keywords
+        self._send_kwargs: dict[str, str | float] = {
+            "model"            : self.default_settings["model"],
+            "temperature"      : self.default_settings["temperature"],
+            "top_p"            : self.default_settings["top_p"],
+            "frequancy_penalty": self.default_settings["frequancy_penalty"],
+            "presence_penalty" : self.default_settings["presence_penalty"],
+        }
+
     def _get_prompt(self):
-        """Creating a formatted prompt"""
-        return self._PROMPT_TEMPLATE.format(commands=self._get_available_commands())
+        """Creating a formatted prompt, rendered once until commands change"""
+        key = (id(self._PROMPT_TEMPLATE), self._version)
+        if self._cached_prompt_key != key:
+            prefix, suffix = split_template(self._PROMPT_TEMPLATE, "commands")
+            self._cached_prompt = prefix + self._get_available_commands() + suffix
+            self._cached_prompt_key = key
+        return self._cached_prompt
 
     @staticmethod
     def _get_messages(
@@ -124,8 +405,8 @@ class AIInterface:
             *,
             system: str = None,
             previous: list[dict[str, str]] = None
-    ) -> list[dict[str, str | list]]:
-        """Create messages request"""
+    ) -> list[dict[str, str]]:
+        """Create messages request, content is sent in the plain string form"""
 
         if system and previous:
             logger.warning("Both 'system' and 'previous' are provided; using 'system' only.")
@@ -133,15 +414,7 @@ class AIInterface:
         result: list[dict[str, str]] = []
         if system:
             logger.debug("System messages requested")
-            result.append(
-                    {
-                        "role"   : "system",
-                        "content": [{
-                            "type": "text",
-                            "text": system,
-                        }]
-                    }
-            )
+            result.append(_system_envelope(system))
         elif previous:
             logger.debug("Previous messages requested")
             result.extend(previous)
@@ -150,15 +423,139 @@ class AIInterface:
                     "Neither 'system' nor 'previous' commands provided to create messages."
             )
 
-        result.append(
-                {
-                    "role"   : "user",
-                    "content": [{
-                        "type": "text",
-                        "text": user_request,
-                    }]
-                }
-        )
+        result.append({"role": "user", "content": user_request})
+        return result
+
+    def _cache_key(
+            self,
+            messages_list: list[dict[str, str]],
+            model: str,
+            temperature: float,
+            top_p: float,
+            frequancy_penalty: float,
+            presence_penalty: float,
+            cache: Optional[bool] = None,
+    ) -> Optional[str]:
+        """
+        Returns the response cache key or None if the request should not be cached.
+        Without an explicit cache flag only reproducible (zero temperature) requests are cached.
+        """
+        if cache is None:
+            cache = self._enable_cache or temperature == 0
+        if not cache:
+            return None
+        return hashlib.blake2b(
+                orjson.dumps(
+                        [messages_list, model, temperature, top_p,
+                         frequancy_penalty, presence_penalty],
+                        option=orjson.OPT_SORT_KEYS,
+                        default=str,
+                )
+        ).hexdigest()
+
+    def _cache_get(self, key: Optional[str]) -> Optional[dict[str, list | dict]]:
+        if key is None or key not in self._response_cache:
+            return None
+        logger.debug("Response cache hit")
+        self._response_cache.move_to_end(key)
+        # commands args are mutated while applying, never hand out the cached dict
+        return copy.deepcopy(self._response_cache[key])
+
+    def _cache_store(self, key: Optional[str], result: dict[str, list | dict]) -> None:
+        if key is None or not result:
+            return
+        self._response_cache[key] = copy.deepcopy(result)
+        if len(self._response_cache) > self._response_cache_size:
+            self._response_cache.popitem(last=False)
+
+    @staticmethod
+    def _scan_json(data: bytes, state: list) -> bool:
+        """
+        Advances [depth, in_string, escaped] over the data and
+        returns True once the outer json object is closed.
+        """
+        depth, in_string, escaped = state
+        closed = False
+        for byte in data:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif byte == _BACKSLASH:
+                    escaped = True
+                elif byte == _QUOTE:
+                    in_string = False
+            elif byte == _QUOTE:
+                in_string = True
+            elif byte == _OPEN_BRACE:
+                depth += 1
+            elif byte == _CLOSE_BRACE and depth:
+                depth -= 1
+                if not depth:
+                    closed = True
+                    break
+        state[:] = depth, in_string, escaped
+        return closed
+
+    @staticmethod
+    def _read_stream(response) -> bytes:
+        """
+        Collects streamed message content and stops reading as soon as
+        the outer json object is closed.
+        """
+        raw = bytearray()
+        state = [0, False, False]
+        for chunk in response:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            data = chunk.choices[0].delta.content.encode()
+            raw.extend(data)
+            if AIInterface._scan_json(data, state):
+                logger.debug("Json object closed, stopping the stream")
+                response.close()
+                break
+        return bytes(raw)
+
+    @staticmethod
+    async def _aread_stream(response) -> bytes:
+        """Async version of _read_stream"""
+        raw = bytearray()
+        state = [0, False, False]
+        async for chunk in response:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            data = chunk.choices[0].delta.content.encode()
+            raw.extend(data)
+            if AIInterface._scan_json(data, state):
+                logger.debug("Json object closed, stopping the stream")
+                await response.close()
+                break
+        return bytes(raw)
+
+    @staticmethod
+    def _parse_text(content) -> dict[str, list | dict]:
+        """Parses commands out of the message content"""
+        return AIInterface._parse_raw(content.encode() if content else b"")
+
+    @staticmethod
+    def _parse_raw(raw: bytes) -> dict[str, list | dict]:
+        """Parses commands out of the raw message bytes"""
+        result = {}
+        if not raw.strip():
+            logger.warning("Response did not return anything.")
+            # TODO IMPLEMENT LOGIC FOR NO RESPONSE
+            return result
+        try:
+            result = orjson.loads(raw)
+        except orjson.JSONDecodeError as e:
+            # models sometimes wrap the json into text or markdown fences
+            match = _JSON_BLOCK_RE.search(raw)
+            try:
+                result = orjson.loads(match.group(0)) if match else {}
+            except orjson.JSONDecodeError:
+                pass
+            if not result:
+                logger.critical("Response is not valid JSON. %s", e)
+                # TODO LOGIC FOR HANDLING THAT
         return result
 
     def _send_request(
@@ -169,8 +566,17 @@ class AIInterface:
             top_p: float = 0.9,
             frequancy_penalty: float = 0.0,
             presence_penalty: float = 0.0,
-    ) -> dict[str, dict[str, str]]:
+            cache: Optional[bool] = None,
+    ) -> dict[str, list | dict]:
         """Send request to LLM with messages"""
+        key = self._cache_key(
+                messages_list, model, temperature, top_p,
+                frequancy_penalty, presence_penalty, cache,
+        )
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
         try:
             response = self._client.chat.completions.create(
                     model=model,
@@ -182,28 +588,99 @@ class AIInterface:
                     temperature=temperature,
                     top_p=top_p,
                     presence_penalty=presence_penalty,
+                    stream=True,
             )
+            raw = self._read_stream(response)
         except KeyError as e:
             raise InterfaceOpenAIException("Invalid keys were provided.") from e
         except OpenAIError as e:
             raise InterfaceOpenAIException("OpenAI API error") from e
+        except httpx.HTTPError as e:
+            # the stream body is read from httpx directly, outside of the SDK error handling
+            raise InterfaceOpenAIException("Response stream was interrupted") from e
 
-        response_text = str(response.choices[0].message.content).strip()
+        result = self._parse_raw(raw)
+        self._cache_store(key, result)
+        return result
+
+    async def _asend_request(
+            self,
+            messages_list: list[dict[str, str]],
+            model: str = "gpt-4",
+            temperature: float = 1,
+            top_p: float = 0.9,
+            frequancy_penalty: float = 0.0,
+            presence_penalty: float = 0.0,
+            cache: Optional[bool] = None,
+    ) -> dict[str, list | dict]:
+        """Async version of _send_request, shares the response cache"""
+        key = self._cache_key(
+                messages_list, model, temperature, top_p,
+                frequancy_penalty, presence_penalty, cache,
+        )
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
 
-        result = {}
-        if not response_text:
-            logger.warning("Response did not return anything.")
-            # TODO IMPLEMENT LOGIC FOR NO RESPONSE
         try:
-            result = json.loads(response_text)
-        except json.decoder.JSONDecodeError as e:
-            logger.critical("Response is not valid JSON. %s", e)
-            # TODO LOGIC FOR HANDLING THAT
+            response = await self._aclient.chat.completions.create(
+                    model=model,
+                    messages=messages_list,
+                    frequency_penalty=frequancy_penalty,
+                    response_format={
+                        "type": "text",
+                    },
+                    temperature=temperature,
+                    top_p=top_p,
+                    presence_penalty=presence_penalty,
+                    stream=True,
+            )
+            raw = await self._aread_stream(response)
+        except KeyError as e:
+            raise InterfaceOpenAIException("Invalid keys were provided.") from e
+        except OpenAIError as e:
+            raise InterfaceOpenAIException("OpenAI API error") from e
+        except httpx.HTTPError as e:
+            raise InterfaceOpenAIException("Response stream was interrupted") from e
 
+        result = self._parse_raw(raw)
+        self._cache_store(key, result)
         return result
 
+    def _embed(self, text: str) -> np.ndarray:
+        """Returns normalized embedding of the text"""
+        try:
+            response = self._client.embeddings.create(model=self._embedding_model, input=text)
+        except OpenAIError as e:
+            raise InterfaceOpenAIException("OpenAI API error") from e
+
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _semantic_lookup(self, query: np.ndarray) -> Optional[dict[str, list | dict]]:
+        """Returns commands of the most similar previous request if it is close enough"""
+        if self._semantic_vectors is None:
+            return None
+        scores = self._semantic_vectors @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self._semantic_threshold:
+            return None
+        logger.debug("Semantic cache hit with similarity %.3f", scores[best])
+        return copy.deepcopy(self._semantic_commands[best])
+
+    def _semantic_store(self, query: np.ndarray, commands: dict[str, list | dict]) -> None:
+        """Remembers commands that were successfully applied for the request"""
+        if self._semantic_vectors is None:
+            self._semantic_vectors = query[np.newaxis, :]
+        else:
+            self._semantic_vectors = np.vstack([self._semantic_vectors, query])
+        self._semantic_commands.append(commands)
+        if len(self._semantic_commands) > self._response_cache_size:
+            self._semantic_vectors = self._semantic_vectors[1:]
+            self._semantic_commands.pop(0)
+
     def _back_frame(self, df: DataFrame) -> None:
-        self._backup.append(df.copy(deep=True))
+        self._backup.append(df.copy(deep=False))
 
     def get_last_frame(self) -> DataFrame:
         return self._backup.pop()
@@ -211,61 +688,458 @@ class AIInterface:
     def reset_frame(self) -> DataFrame:
         return self._backup[0] if self._backup else DataFrame()
 
-    def _apply_commands(
+    def _compile_predicate(self, source: str) -> Callable:
+        """Checks and compiles predicate source once, the callable is reused for the same source"""
+        predicate = self._predicate_cache.get(source)
+        if predicate is None:
+            logger.debug("Compiling predicate: %s", source)
+            try:
+                tree = ast.parse(source.strip(), "<predicate>", "eval")
+            except SyntaxError as e:
+                raise InterfaceException(f"Predicate {source} is not valid: {e}") from e
+            problem = _check_predicate(tree)
+            if problem is not None:
+                raise InterfaceException(f"Predicate {source} is not valid: {problem}.")
+            predicate = eval(compile(tree, "<predicate>", "eval"), _SAFE_GLOBALS, {})
+            self._predicate_cache[source] = predicate
+        return predicate
+
+    def _validate_commands(
             self,
             df: DataFrame,
-            commands: dict[str, dict[str, str]],
-    ) -> DataFrame:
-        for comm_name, comm_args in commands.items():
-            logger.info(f"Applying command: %s with %s", comm_name, comm_args)
+            response: dict[str, list | dict],
+    ) -> list[Command]:
+        """
+        Checks the model response locally and fixes what can be fixed without a new request:
+        the legacy {name: kwargs} shape, command and argument names casing.
+        Raises InterfaceException listing every problem that is left.
+        """
+        if not isinstance(response, dict):
+            raise InterfaceException(f"Expected a JSON object with commands, got {response}.")
+        errors: list[str] = []
+        commands = response.get("commands")
+        if commands is None:
+            commands = []
+            for name, kwargs in response.items():
+                if name == "preconditions":
+                    continue
+                if not isinstance(kwargs, dict):
+                    errors.append(f"Command {name} kwargs {kwargs} are not an object.")
+                    continue
+                commands.append({"command": name, "kwargs": kwargs})
+        if not isinstance(commands, list):
+            raise InterfaceException(f"Expected a list of commands, got {commands}.")
+        if not commands and not errors:
+            raise InterfaceException("No commands were given.")
+
+        preconditions = response.get("preconditions") or {}
+        columns = (preconditions.get("columns") or []) if isinstance(preconditions, dict) else None
+        if not isinstance(columns, list):
+            raise InterfaceException(
+                    f"Expected preconditions with a list of columns, got {preconditions}."
+            )
+        missing = [column for column in columns
+                   if not isinstance(column, Hashable) or column not in df.columns]
+        if missing:
+            errors.append(
+                    f"Columns {missing} do not exist, available columns: {list(df.columns)}."
+            )
+
+        validated: list[Command] = []
+        for item in commands:
+            if not isinstance(item, dict) or not isinstance(item.get("command"), str):
+                errors.append(f"Command {item} has no 'command' name.")
+                continue
+            comm_name = item["command"]
             if comm_name not in self.commands:
-                raise InterfaceException(f"Command {comm_name} not supported.")
+                comm_name = self._commands_lower.get(comm_name.strip().lower())
+                if comm_name is None:
+                    errors.append(f"Command {item['command']} not supported.")
+                    continue
+                logger.debug("Fixed command name %s to %s", item["command"], comm_name)
 
-            try:
-                # TODO TEST THIS AND ADD DEBUG
-                if comm_args.get("predicate"):
-                    comm_args["predicate"] = eval(comm_args["predicate"])
+            parameters = self._commands_signature[comm_name].parameters
+            # the first parameter is the DataFrame itself
+            accepted = dict(list(parameters.items())[1:])
+            any_kwargs = any(param.kind is param.VAR_KEYWORD for param in accepted.values())
+            lower = {name.lower(): name for name in accepted}
+
+            received = item["kwargs"] if "kwargs" in item else None
+            if received is None:
+                received = {}
+            elif not isinstance(received, dict):
+                errors.append(f"Command {comm_name} kwargs {received} are not an object.")
+                continue
+
+            kwargs = {}
+            for arg_name, arg_value in received.items():
+                if arg_name not in accepted and not any_kwargs:
+                    fixed = lower.get(arg_name.lower())
+                    if fixed is None:
+                        errors.append(f"Command {comm_name} has no argument {arg_name}.")
+                        continue
+                    arg_name = fixed
+                kwargs[arg_name] = arg_value
+
+            for name, param in accepted.items():
+                if (param.default is param.empty and name not in kwargs
+                        and param.kind not in (param.VAR_KEYWORD, param.VAR_POSITIONAL)):
+                    errors.append(f"Command {comm_name} is missing argument {name}.")
+            validated.append(Command(comm_name, kwargs))
+
+        if errors:
+            raise InterfaceException(" ".join(errors))
+        return validated
 
-                df = self.commands[comm_name](df, **comm_args)
+    def _fuse_column_commands(
+            self,
+            df: DataFrame,
+            pending: list[tuple[str, Callable, dict]],
+    ) -> DataFrame:
+        """
+        Applies a run of column only commands (select, drop, rename) with a single selection.
+        The run is planned on column labels, no intermediate frames are created.
+        """
+        if len(pending) < 2 or not df.columns.is_unique:
+            for comm_name, command, comm_args in pending:
+                df = self._run_command(df, comm_name, command, comm_args)
+            return df
+
+        originals = list(df.columns)
+        # original label -> label after the commands applied so far
+        names = {column: column for column in originals}
+        for comm_name, command, comm_args in pending:
+            operation = self._column_commands[comm_name]
+            argument = comm_args["mapping" if operation == "rename" else "columns"]
+            if not isinstance(argument, dict if operation == "rename" else list):
+                break
+            current = {names[column]: column for column in originals}
+            try:
+                if operation == "select":
+                    originals = [current[column] for column in argument]
+                elif operation == "drop":
+                    dropped = {current[column] for column in argument}
+                    originals = [column for column in originals if column not in dropped]
+                else:
+                    for old, new in argument.items():
+                        if old in current:
+                            names[current[old]] = new
             except KeyError as e:
-                raise InterfaceException(
-                        f"Command {comm_name} with args {comm_args}"
-                        f"gave an error: {e}"
-                )
+                raise CommandApplyError(comm_name, comm_args, e) from e
+            if len({names[column] for column in originals}) != len(originals):
+                break
+        else:
+            logger.debug("Fused %s column commands", len(pending))
+            return df.loc[:, originals].set_axis([names[column] for column in originals], axis=1)
+
+        # labels collide or arguments have an unexpected shape, let pandas handle it
+        for comm_name, command, comm_args in pending:
+            df = self._run_command(df, comm_name, command, comm_args)
         return df
 
-    def transform(self, df: DataFrame, user_request: str, retry_count: int = 3) -> DataFrame:
+    def _run_command(
+            self,
+            df: DataFrame,
+            comm_name: str,
+            command: Callable,
+            comm_args: dict,
+    ) -> DataFrame:
+        # the retry prompt shows comm_args, so the compiled predicate goes into a separate dict
+        call_args = comm_args
+        predicate = comm_args.get("predicate")
+        from_model = isinstance(predicate, str)
+        if from_model:
+            if _COMPARISON_RE.match(predicate):
+                # comparison strings like "> 50" are left for the vectorized filter
+                problem = _check_comparison(predicate)
+                if problem is not None:
+                    raise InterfaceException(f"Predicate {predicate} is not valid: {problem}.")
+            else:
+                call_args = {**comm_args, "predicate": self._compile_predicate(predicate)}
+
+        try:
+            result = command(df, **call_args)
+        except KeyError as e:
+            raise CommandApplyError(comm_name, comm_args, e) from e
+        except Exception as e:
+            if not from_model:
+                raise
+            # the predicate is only evaluated here, its errors go back to the model like others
+            raise CommandApplyError(comm_name, comm_args, e) from e
+        # commands like save_to_csv only have side effects, the frame stays the same
+        return df if result is None else result
+
+    def _apply_commands(
+            self,
+            df: DataFrame,
+            response: dict[str, list | dict],
+    ) -> DataFrame:
+        # commands may work in place, copy-on-write keeps the caller's frame untouched
+        df = df.copy(deep=False)
+        commands_get = self._commands_get
+        pending: list[tuple[str, Callable, dict]] = []
+        for comm_name, comm_args in self._validate_commands(df, response):
+            logger.debug("Applying command: %s with %s", comm_name, comm_args)
+            command = commands_get(comm_name)
+            if command is None:
+                raise InterfaceException(f"Command {comm_name} not supported.")
+
+            if comm_name in self._column_commands:
+                pending.append((comm_name, command, comm_args))
+                continue
+            if pending:
+                df = self._fuse_column_commands(df, pending)
+                pending = []
+            df = self._run_command(df, comm_name, command, comm_args)
+        return self._fuse_column_commands(df, pending)
+
+    def transform(
+            self,
+            df: DataFrame,
+            user_request: str,
+            retry_count: int = 3,
+            cache: Optional[bool] = None,
+    ) -> DataFrame:
         self._back_frame(df)
         prompt = self._get_prompt()
         messages_list = self._get_messages(user_request, system=prompt)
 
-        def _request_and_apply(dfr: DataFrame, messages) -> None:
-            commands = self._send_request(
-                    messages_list=messages,
-                    model=self.default_settings["model"],
-                    temperature=self.default_settings["temperature"],
-                    top_p=self.default_settings["top_p"],
-                    frequancy_penalty=self.default_settings["presence_penalty"],
-            )
-            logger.info(f"Commands received: {commands}")
-            self._apply_commands(dfr, commands)
+        # cache=False bypasses every cache, the semantic one is neither read nor written
+        use_semantic = self._semantic_cache and cache is not False
+        query = self._embed(user_request) if use_semantic else None
+        if query is not None:
+            cached = self._semantic_lookup(query)
+            if cached is not None:
+                try:
+                    return self._apply_commands(df, cached)
+                except InterfaceException:
+                    logger.warning("Cached commands failed to execute, requesting new ones.")
+                    df = self._backup[-1].copy(deep=False)
+
+        def _request_and_apply(dfr: DataFrame, messages) -> DataFrame:
+            commands = self._send_request(messages_list=messages, cache=cache, **self._send_kwargs)
+            logger.info("Commands received: %s", commands)
+            received = copy.deepcopy(commands) if query is not None else None
+            dfr = self._apply_commands(dfr, commands)
+            if query is not None:
+                self._semantic_store(query, received)
+            return dfr
 
         for retry in range(retry_count + 1):
             try:
-                _request_and_apply(df, messages_list)
+                df = _request_and_apply(df, messages_list)
                 break
             except InterfaceException as e:
                 if retry < retry_count:
                     logger.warning("Error during execution occurred, retry started.")
-                    df = self.get_last_frame()
-                    prompt = (f"Given commands failed to execute.\nTraceback {e}.\n"
-                              f"Fix the problem and try again.")
+                    # _apply_commands never changes its input, the backup is reused on every retry
+                    df = self._backup[-1].copy(deep=False)
+                    prompt = _get_error_prompt(self._PROMPT_TEMPLATE_ERROR, str(e))
                     messages_list = self._get_messages(user_request=prompt, previous=messages_list)
                 else:
                     logger.warning("Limit of retries reached. Execution aborted.")
-                    df = self.reset_frame()
+                    df = self._backup[-1]
         return df
 
+    async def atransform(
+            self,
+            df: DataFrame,
+            user_request: str,
+            retry_count: int = 3,
+            cache: Optional[bool] = None,
+    ) -> DataFrame:
+        """
+        Async version of transform. It rolls back to its own copy of the frame instead of
+        the shared backup stack, so several calls can be gathered concurrently.
+        """
+        original = df.copy(deep=False)
+        messages_list = self._get_messages(user_request, system=self._get_prompt())
+
+        for retry in range(retry_count + 1):
+            try:
+                commands = await self._asend_request(
+                        messages_list=messages_list, cache=cache, **self._send_kwargs
+                )
+                logger.info("Commands received: %s", commands)
+                # pandas work is GIL bound, it runs between the awaits of other requests
+                return self._apply_commands(original.copy(deep=False), commands)
+            except InterfaceException as e:
+                if retry < retry_count:
+                    logger.warning("Error during execution occurred, retry started.")
+                    prompt = _get_error_prompt(self._PROMPT_TEMPLATE_ERROR, str(e))
+                    messages_list = self._get_messages(user_request=prompt, previous=messages_list)
+
+        logger.warning("Limit of retries reached. Execution aborted.")
+        return original
+
+    async def transform_batch(
+            self,
+            df: DataFrame,
+            user_requests: list[str],
+            max_concurrency: int = 8,
+            cache: Optional[bool] = None,
+    ) -> list[DataFrame]:
+        """
+        Transforms its own copy of the frame for every user request, with at most
+        max_concurrency requests to OpenAI in flight.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _transform(user_request: str) -> DataFrame:
+            async with semaphore:
+                return await self.atransform(df, user_request, cache=cache)
+
+        return list(await asyncio.gather(*(_transform(request) for request in user_requests)))
+
+    def transform_many(
+            self,
+            dfs: list[DataFrame],
+            user_requests: list[str],
+            max_workers: int = 4,
+            cache: Optional[bool] = None,
+    ) -> list[DataFrame]:
+        """
+        Sends all user requests as numbered tasks in a single request and applies every
+        task to its frame. Tasks that are missing or fail are retried one by one with transform.
+        """
+        if len(dfs) != len(user_requests):
+            raise InterfaceException("Every user request needs its own DataFrame.")
+        if not user_requests:
+            return []
+
+        prefix, suffix = split_template(self._PROMPT_TEMPLATE_TASKS, "tasks")
+        tasks = "\n".join(
+                f"Task {task_id}: {request}" for task_id, request in enumerate(user_requests)
+        )
+        messages_list = self._get_messages(prefix + tasks + suffix, system=self._get_prompt())
+        response = self._send_request(
+                messages_list=messages_list,
+                cache=cache,
+                **self._send_kwargs,
+        )
+        logger.info("Tasks received: %s", response)
+
+        # a task without its own list of commands counts as missing
+        answers: dict[int, dict] = {}
+        received = response.get("tasks") if isinstance(response, dict) else None
+        for task in received if isinstance(received, list) else []:
+            if (isinstance(task, dict) and isinstance(task.get("id"), int)
+                    and isinstance(task.get("commands"), list)):
+                answers[task["id"]] = task
+
+        # marks failed tasks, a successful task can not be told apart by its frame
+        failed = object()
+
+        def _apply(task_id: int) -> DataFrame | object:
+            if task_id not in answers:
+                return failed
+            try:
+                return self._apply_commands(dfs[task_id], answers[task_id])
+            except InterfaceException as e:
+                logger.warning("Task %s failed: %s", task_id, e)
+                return failed
+
+        # many pandas operations release the GIL, so frames are processed side by side
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_apply, range(len(dfs))))
+
+        for task_id, result in enumerate(results):
+            if result is failed:
+                logger.warning("Retrying task %s on its own.", task_id)
+                results[task_id] = self.transform(
+                        dfs[task_id], user_requests[task_id], cache=cache
+                )
+        return results
+
+    def submit_batch(self, user_requests: list[str]) -> str:
+        """
+        Submits user requests to the OpenAI Batch API and returns the batch id.
+        Results are collected later with poll_batch.
+        """
+        if not self._use_batch_api:
+            raise InterfaceException(
+                    "Batch API is disabled, create the interface with use_batch_api=True."
+            )
+
+        prompt = self._get_prompt()
+        lines: list[bytes] = []
+        for custom_id, user_request in enumerate(user_requests):
+            lines.append(orjson.dumps({
+                "custom_id": str(custom_id),
+                "method"   : "POST",
+                "url"      : "/v1/chat/completions",
+                "body"     : {
+                    "model"            : self._send_kwargs["model"],
+                    "messages"         : self._get_messages(user_request, system=prompt),
+                    "temperature"      : self._send_kwargs["temperature"],
+                    "top_p"            : self._send_kwargs["top_p"],
+                    "frequency_penalty": self._send_kwargs["frequancy_penalty"],
+                    "presence_penalty" : self._send_kwargs["presence_penalty"],
+                },
+            }))
+
+        try:
+            batch_file = self._client.files.create(
+                    file=("batch.jsonl", b"\n".join(lines)),
+                    purpose="batch",
+            )
+            batch = self._client.batches.create(
+                    input_file_id=batch_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h",
+            )
+        except OpenAIError as e:
+            raise InterfaceOpenAIException("OpenAI API error") from e
+
+        logger.info("Batch submitted: %s with %s requests", batch.id, len(user_requests))
+        return batch.id
+
+    def _read_batch_file(self, file_id: Optional[str]) -> list[dict]:
+        """Returns the JSONL lines of a batch output or error file, batches may have neither"""
+        if file_id is None:
+            return []
+        text = self._client.files.content(file_id).text
+        return [orjson.loads(line) for line in text.splitlines() if line.strip()]
+
+    def poll_batch(self, batch_id: str) -> Optional[list[Optional[dict[str, list | dict]]]]:
+        """
+        Returns parsed commands for every submitted request in submission order
+        or None if the batch is still in progress. Failed requests are logged and left as None.
+        """
+        if not self._use_batch_api:
+            raise InterfaceException(
+                    "Batch API is disabled, create the interface with use_batch_api=True."
+            )
+
+        try:
+            batch = self._client.batches.retrieve(batch_id)
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise InterfaceOpenAIException(
+                        f"Batch {batch_id} finished with status {batch.status}."
+                )
+            if batch.status != "completed":
+                logger.debug("Batch %s is %s", batch_id, batch.status)
+                return None
+            # a batch where every request failed has no output file, only the error file
+            items = self._read_batch_file(batch.output_file_id)
+            items += self._read_batch_file(batch.error_file_id)
+        except OpenAIError as e:
+            raise InterfaceOpenAIException("OpenAI API error") from e
+
+        results: dict[int, Optional[dict[str, list | dict]]] = {}
+        for item in items:
+            custom_id = int(item["custom_id"])
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or (response.get("body") or {}).get("error")
+                logger.warning("Batch request %s failed: %s", custom_id, error)
+                results[custom_id] = None
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            results[custom_id] = self._parse_text(content)
+        total = batch.request_counts.total if batch.request_counts else len(results)
+        return [results.get(custom_id) for custom_id in range(total)]
+
 
 if __name__ == '__main__':
     user = ("I need to rename the Column x to my Column and also remove the rows with the empty "
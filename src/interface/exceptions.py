@@ -5,4 +5,16 @@ class InterfaceOpenAIException(InterfaceException):
     pass
 
 class UnknownModelException(InterfaceOpenAIException):
-    pass
\ No newline at end of file
+    pass
+
+class CommandApplyError(InterfaceException):
+    """Keeps the failed command context, the message is only built when it is shown"""
+
+    def __init__(self, command: str, kwargs: dict, cause: Exception) -> None:
+        super().__init__(command, kwargs, cause)
+        self.command = command
+        self.kwargs = kwargs
+        self.cause = cause
+
+    def __str__(self) -> str:
+        return f"Command {self.command} with args {self.kwargs} gave an error: {self.cause}"
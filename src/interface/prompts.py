@@ -1,3 +1,5 @@
+import functools
+
 PROMPT_TEMPLATE: str = """
 You are an advanced data scientist assistant who generates Python transformations for pandas DataFrames.
 
@@ -12,14 +14,61 @@ Available commands:
 
 Format your response as follows (no extra keys or text):
 {{
-    "first_command_name": {{
-        "first_key_arg": "arg_value",
-        "second_key_arg": "arg_value",
-        "third_key_arg": "arg_value"
-    }},
-    "second_command_name": {{
-        "first_key_arg": "arg_value"
+    "commands": [
+        {{
+            "command": "first_command_name",
+            "kwargs": {{
+                "first_key_arg": "arg_value",
+                "second_key_arg": "arg_value"
+            }}
+        }},
+        {{
+            "command": "second_command_name",
+            "kwargs": {{
+                "first_key_arg": "arg_value"
+            }}
+        }}
+    ],
+    "preconditions": {{
+        "columns": ["column names that must exist in the DataFrame before the first command"]
     }}
 }}
+- List every command in the order of execution, a command can be used more than once.
+- Before answering, check that every command exists in the available commands and that it
+  only uses its listed arguments with all required ones provided.
 - Return the result in **valid JSON** format, and do not include any extra text or explanations outside the JSON structure.
-"""
\ No newline at end of file
+"""
+
+PROMPT_TEMPLATE_ERROR: str = """Given commands failed to execute.
+Traceback {error_msg}.
+Fix the problem and try again."""
+
+
+PROMPT_TEMPLATE_TASKS: str = """Solve every task below independently, each task works on its own DataFrame.
+{tasks}
+
+Use the same command format as above for every task and answer with (no extra keys or text):
+{{
+    "tasks": [
+        {{
+            "id": 0,
+            "commands": [],
+            "preconditions": {{}}
+        }}
+    ]
+}}
+- Return exactly one entry for every task id.
+- Return the result in **valid JSON** format, and do not include any extra text or explanations outside the JSON structure."""
+
+
+@functools.lru_cache(maxsize=8)
+def split_template(template: str, field: str) -> tuple[str, str]:
+    """
+    Splits template around its single {field} placeholder and unescapes the braces once,
+    so rendering becomes prefix + value + suffix without str.format parsing the template.
+    """
+    prefix, suffix = template.split("{" + field + "}")
+    return (
+        prefix.replace("{{", "{").replace("}}", "}"),
+        suffix.replace("{{", "{").replace("}}", "}"),
+    )
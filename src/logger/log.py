@@ -1,4 +1,5 @@
 import logging
+import sys
 from os import environ
 
 
@@ -13,15 +14,23 @@ class LogFormatter(logging.Formatter):
 
     RESET = "\033[0m"  # Reset color
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Colors only make sense on a terminal, files and log collectors get plain text
+        self._colorize = sys.stderr.isatty()
+        self._reset = self.RESET
+
     def format(self, record):
         # Get the original log message
         log_message = super().format(record)
+        if not self._colorize:
+            return log_message
 
         # Get the color based on the log level
-        color = self.COLORS.get(record.levelno, self.RESET)
+        color = self.COLORS.get(record.levelno, self._reset)
 
         # Return the colored log message
-        return f"{color}{log_message}{self.RESET}"
+        return color + log_message + self._reset
 
 
 DEBUG: bool = "TRUE" == environ.get("DEBUG", "TRUE")
@@ -0,0 +1,187 @@
+import asyncio
+import functools
+import unittest
+from types import SimpleNamespace
+
+import httpx
+import pandas as pd
+
+from src.interface.ai_inter import AIInterface
+from src.interface.exceptions import InterfaceOpenAIException
+from src.transforms import trasform_funcs
+
+
+def _chunk(content: str) -> SimpleNamespace:
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class _BrokenStream:
+    """Streams the first chunk and then loses the connection"""
+
+    def __init__(self, content: str) -> None:
+        self.content = content
+
+    def __iter__(self):
+        yield _chunk(self.content)
+        raise httpx.ReadTimeout("timed out")
+
+    def close(self) -> None:
+        pass
+
+
+class _ABrokenStream(_BrokenStream):
+    """Async version of _BrokenStream"""
+
+    async def __aiter__(self):
+        yield _chunk(self.content)
+        raise httpx.RemoteProtocolError("peer closed connection")
+
+    async def close(self) -> None:
+        pass
+
+
+def _client(create) -> SimpleNamespace:
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+class StreamErrorsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.interface = AIInterface(load_modules=[trasform_funcs])
+        self.calls = 0
+
+        def create(**kwargs):
+            self.calls += 1
+            return _BrokenStream('{"commands": [')
+
+        self.interface._client_impl = _client(create)
+
+    def test_interrupted_stream_raises_interface_error(self) -> None:
+        with self.assertRaises(InterfaceOpenAIException):
+            self.interface._send_request(messages_list=[])
+
+    def test_transform_retries_interrupted_stream(self) -> None:
+        df = pd.DataFrame({"a": [1, 2]})
+        result = self.interface.transform(df, "drop rows with missing values", retry_count=2)
+        self.assertEqual(self.calls, 3)
+        pd.testing.assert_frame_equal(result, df)
+
+
+class AsyncStreamErrorsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.interface = AIInterface(load_modules=[trasform_funcs])
+        self.calls = 0
+
+        async def create(**kwargs):
+            self.calls += 1
+            return _ABrokenStream('{"commands": [')
+
+        self.interface._aclient_impl = _client(create)
+
+    def test_interrupted_stream_raises_interface_error(self) -> None:
+        with self.assertRaises(InterfaceOpenAIException):
+            asyncio.run(self.interface._asend_request(messages_list=[]))
+
+    def test_transform_batch_retries_interrupted_stream(self) -> None:
+        df = pd.DataFrame({"a": [1, 2]})
+        results = asyncio.run(self.interface.transform_batch(df, ["first", "second"]))
+        # atransform retries three times after the first attempt
+        self.assertEqual(self.calls, 8)
+        for result in results:
+            pd.testing.assert_frame_equal(result, df)
+
+
+class SemanticCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.interface = AIInterface(load_modules=[trasform_funcs], semantic_cache=True)
+        self.interface._send_request = lambda **kwargs: {
+            "commands": [{"command": "drop_missing_values", "kwargs": {}}],
+        }
+
+    def test_cache_false_skips_semantic_cache(self) -> None:
+        def fail(*args, **kwargs):
+            raise AssertionError("semantic cache was used")
+
+        self.interface._embed = fail
+        self.interface._semantic_lookup = fail
+        self.interface._semantic_store = fail
+        df = pd.DataFrame({"a": [1, None]})
+        result = self.interface.transform(df, "drop rows with missing values", cache=False)
+        self.assertEqual(len(result), 1)
+
+
+class TransformManyTest(unittest.TestCase):
+    def test_no_requests_sends_nothing(self) -> None:
+        interface = AIInterface(load_modules=[trasform_funcs])
+
+        def fail(**kwargs):
+            raise AssertionError("request was sent")
+
+        interface._send_request = fail
+        self.assertEqual(interface.transform_many([], []), [])
+
+
+class _Scale:
+    """Scales the column by the factor"""
+    __slots__ = ("__name__",)
+
+    def __init__(self) -> None:
+        self.__name__ = "scale"
+
+    def __call__(self, df: pd.DataFrame, column: str, factor: float) -> pd.DataFrame:
+        df[column] = df[column] * factor
+        return df
+
+
+class CommandRegistrationTest(unittest.TestCase):
+    def test_command_without_weak_references(self) -> None:
+        interface = AIInterface(load_modules=None)
+        interface.add_command(_Scale())
+        self.assertEqual(list(interface._commands_signature["scale"].parameters),
+                         ["df", "column", "factor"])
+        self.assertIn("Scales the column by the factor", interface._get_available_commands())
+
+
+def _wrapped(command):
+    @functools.wraps(command)
+    def wrapper(*args, **kwargs):
+        return command(*args, **kwargs)
+    return wrapper
+
+
+class ColumnFusionTest(unittest.TestCase):
+    response = {"commands": [
+        {"command": "rename_columns", "kwargs": {"mapping": {"a": "b"}}},
+        {"command": "drop_columns", "kwargs": {"columns": ["c"]}},
+    ]}
+
+    def _assert_fused(self, interface: AIInterface) -> None:
+        def fail(*args, **kwargs):
+            raise AssertionError("command was applied on its own")
+
+        interface._run_command = fail
+        df = pd.DataFrame({"a": [1], "c": [2]})
+        result = interface._apply_commands(df, self.response)
+        self.assertEqual(list(result.columns), ["b"])
+
+    def test_module_commands_are_fused(self) -> None:
+        self._assert_fused(AIInterface(load_modules=[trasform_funcs]))
+
+    def test_wrapped_commands_are_fused(self) -> None:
+        interface = AIInterface(load_modules=None)
+        interface.add_command(_wrapped(trasform_funcs.rename_columns))
+        interface.add_command(_wrapped(trasform_funcs.drop_columns))
+        self._assert_fused(interface)
+
+    def test_operation_given_on_registration(self) -> None:
+        def drop_columns(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+            """Drops the columns"""
+            return df.drop(columns=columns)
+
+        interface = AIInterface(load_modules=None)
+        interface.add_command(trasform_funcs.rename_columns)
+        interface.add_command(drop_columns, column_operation="drop")
+        self._assert_fused(interface)
+
+
+if __name__ == '__main__':
+    unittest.main()